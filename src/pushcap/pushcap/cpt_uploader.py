@@ -38,6 +38,8 @@ class CptUploader(RedcapUploader):
         # Iterate over timepoints
         for (subj, event), report in self._reports.items():
             redcap_vals = {}
+            if self._skip_complete:
+                completed_forms = self.completed_forms(subj, event)
             # Redirect warnings to /dev/null, silences the slew of OLE2 warnings
             xlrd_xls = xlrd.open_workbook(report.report_path,
                                           logfile=open(os.devnull, 'w'))
@@ -47,7 +49,7 @@ class CptUploader(RedcapUploader):
                     continue
                 for col, field in self._rc_map[sheet_name].items():
                     if ( self._skip_complete and
-                         self.is_complete(subj, event, field) ):
+                         self.field_form(field) in completed_forms ):
                         continue
                     else:
                         try:
@@ -33,6 +33,8 @@ class DkefsUploader(RedcapUploader):
         for (subj, event) in self._reports.keys():
 
             redcap_vals = {}
+            if self._skip_complete:
+                completed_forms = self.completed_forms(subj, event)
 
             # Iterate over score files for that timepoint
             for (report_path, subform) in self._reports[(subj, event)].reports:
@@ -59,7 +61,7 @@ class DkefsUploader(RedcapUploader):
                             increment_update = False
 
                         if ( self._skip_complete and
-                             self.is_complete(subj, event, field) ):
+                             self.field_form(field) in completed_forms ):
                             continue
 
                         value = form_vals[col_idx]
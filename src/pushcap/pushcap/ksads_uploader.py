@@ -1,19 +1,143 @@
 import re
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
 
-import pdfquery
+import numpy as np
 import pandas as pd
-from pyquery import PyQuery
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LAParams, LTFigure, LTTextBoxHorizontal
 
 from . import RedcapUploader, RedcapUploaderError
 
-
-class Item:
-    def __init__(self, pg, x0, y1, txt):
-        self.pg = int(pg)
-        self.x0 = float(x0)
-        self.y1 = float(y1)
-        self.txt = txt.strip()
+# layout analysis (same as pdfquery's defaults)
+_LAPARAMS = LAParams(all_texts=True, detect_vertical=True)
+# fewest reports worth starting worker processes for; spawned workers
+# re-import numpy, pandas & pdfminer, which a small batch doesn't repay
+_MIN_POOL_REPORTS = 8
+# element filtering
+_RE_DATETIME = re.compile(r"\d\d?/\d\d?/\d\d\d\d")
+# user information
+_KSADS_SOURCES = frozenset(('Parent', 'Youth', 'Teen'))
+_RE_ID = re.compile(r'\d+_\d')
+_RE_DATE = re.compile(r'\d\d?/\d\d?/\d\d\d?\d?')
+# diagnosis columns
+# column type from the text of its first element, alternatives in order of
+# precedence so a single match gives the type via lastgroup
+_RE_COLUMN_TYPE = re.compile(
+    r"(?P<time_x>(?:Current)|(?:Past) Diagnosis)"
+    r"|(?P<no_diag_x>No diagnosis)"
+    r"|(?P<suicid_symp_x>Symptom)"
+    r"|(?P<desc_x>Description)"
+    r"|(?P<casa_x>(?:C-)?\s?CASA\s?Code)"
+    r"|(?P<comments_x>Patient\sComments)"
+)
+_RE_CCASA = re.compile(r'C-\s?CASA\s?Code')
+_RE_COMMENTS = re.compile(r'Patient\sComments')
+# diagnosis & symptom text
+_RE_PRESENT_COMMA = re.compile(r'[,–-] ?present', re.IGNORECASE)
+_RE_PRESENT_PAREN = re.compile(r'[)] present', re.IGNORECASE)
+_RE_TIME = re.compile(r"(\bCurrent)|(\bPast)", re.IGNORECASE)
+_RE_REMISSION = re.compile(r"(full)|(partial) remission", re.IGNORECASE)
+_RE_PARENTHESES = re.compile(r' \([^)]*\)')
+# special characters (fi ligature, right single quote) to plain text
+_SPEC_CHARS = str.maketrans({b'\xef\xac\x81'.decode('utf-8'): 'fi', '’': "'"})
+# special cases
+_RE_SLEEP_PROBLEMS = re.compile('sleep problems|insomnia', re.IGNORECASE)
+_RE_PHOBIA = re.compile('phobi', re.IGNORECASE)
+_RE_ADJUSTMENT = re.compile('adjustment disorder', re.IGNORECASE)
+_RE_DMDD = re.compile('disruptive mood dysregulation', re.IGNORECASE)
+_RE_BIPOLAR_I = re.compile('bipolar I disorder', re.IGNORECASE)
+_RE_STEALING = re.compile('stealing', re.IGNORECASE)
+_RE_IRRITABILITY = re.compile('irritability', re.IGNORECASE)
+_RE_SUICIDAL_IDEATION = re.compile('^suicidal ideation$', re.IGNORECASE)
+_RE_TROUBLE_SLEEPING = re.compile('Patient reported trouble falling asleep or staying asleep', re.IGNORECASE)
+_RE_SUSTAINING = re.compile('Difficulty sustaining', re.IGNORECASE)
+_RE_DISTRACTED = re.compile('easily distracted', re.IGNORECASE)
+_RE_SEATED = re.compile('Difficulty remaining seated', re.IGNORECASE)
+_RE_ELEVATED = re.compile('Elevated', re.IGNORECASE)
+_RE_MOOD = re.compile('mood', re.IGNORECASE)
+_RE_HYPERSEXUALITY = re.compile('Hypersexuality', re.IGNORECASE)
+_RE_DISTRACTIBILITY = re.compile('distractibility', re.IGNORECASE)
+_RE_SUICIDE_ATTEMPT = re.compile('^suicide attempt$', re.IGNORECASE)
+_PREP_ACT_STR = 'preparatory actions toward imminent suicidal behavior'
+_RE_PREP_ACT = re.compile(_PREP_ACT_STR, re.IGNORECASE)
+
+
+def _box_text(box):
+    """
+    Text of a text box with whitespace squashed within each line and
+    non-empty lines joined by newlines
+
+    box: LTTextBoxHorizontal
+
+    returns: text of the box
+    """
+    return '\n'.join(txt for txt in (' '.join(line.get_text().split()) for line in box) if txt)
+
+
+def _tokenize_diag(txt):
+    """
+    Splits diagnosis text by , ( or ) except a ) whose next parenthesis is
+    also a ) (i.e. within nested parentheses)
+    Single pass from the end to track the next parenthesis of each char
+
+    txt: diagnosis text
+
+    returns: first piece stripped followed by the words of the other pieces
+    """
+    cuts = []
+    next_paren = None
+    for i in range(len(txt) - 1, -1, -1):
+        c = txt[i]
+        if c == ',' or c == '(' or (c == ')' and next_paren != ')'):
+            cuts.append(i)
+        if c == '(' or c == ')':
+            next_paren = c
+    if not cuts:
+        return [txt.strip()]
+    cuts.reverse()
+
+    tokens = [txt[:cuts[0]].strip()]
+    for start, end in zip(cuts, cuts[1:] + [len(txt)]):
+        tokens.extend(txt[start + 1:end].split())
+    return tokens
+
+
+def _iter_layout_boxes(layout):
+    """
+    Yields the text boxes of a layout, including the ones within figures
+
+    layout: pdfminer layout container
+    """
+    for obj in layout:
+        if isinstance(obj, LTTextBoxHorizontal):
+            yield obj
+        elif isinstance(obj, LTFigure):
+            yield from _iter_layout_boxes(obj)
+
+
+class Item(NamedTuple):
+    pg: int
+    x0: float
+    y1: float
+    txt: str
+
+
+def _load_text_boxes(path):
+    """
+    Lays out the PDF once to collect all of its text boxes
+    Module level so that it can be run in worker processes
+
+    path: path to the PDF
+
+    returns: list of Items of every text box in page order
+    """
+    boxes = []
+    for pg, page in enumerate(extract_pages(path, laparams=_LAPARAMS)):
+        for box in _iter_layout_boxes(page):
+            boxes.append(Item(pg, round(box.x0, 3), round(box.y1, 3), _box_text(box)))
+    return boxes
 
 
 class KsadsUploader(RedcapUploader):
@@ -25,6 +149,7 @@ class KsadsUploader(RedcapUploader):
         self._token = token
         self._log_path = log_path
         self._template_path = template_path
+        self._load_template()
         if date_fields is None:
             self._date_fields = []
         else:
@@ -39,155 +164,164 @@ class KsadsUploader(RedcapUploader):
         self._skip_complete = skip_complete
 
     @staticmethod
-    def parse_info_elements(doc):
+    def _find_anchor(boxes, match):
+        """
+        boxes: list of Items
+        match: function that takes the text of an Item
+
+        returns: first Item whose text matches or None
+        """
+        return next((box for box in boxes if match(box.txt)), None)
+
+    @staticmethod
+    def _box_coords(boxes):
+        """
+        boxes: list of Items
+
+        returns: arrays of the page, x0 & y1 of each Item
+        """
+        n = len(boxes)
+        pgs = np.fromiter((box.pg for box in boxes), dtype=np.int64, count=n)
+        x0s = np.fromiter((box.x0 for box in boxes), dtype=np.float64, count=n)
+        y1s = np.fromiter((box.y1 for box in boxes), dtype=np.float64, count=n)
+        return pgs, x0s, y1s
+
+    @staticmethod
+    def parse_info_elements(boxes):
         """
-        Parses PDF document to only get user information elements
+        Filters the text boxes to only get user information elements
 
-        doc: PDF document
+        boxes: list of Items of the PDF document
 
-        returns: LTTBH elements of user information
+        returns: Items of user information
         """
         # get current diagnosis element
-        curr_diag_el = doc.find('LTTextBoxHorizontal').filter(
-            lambda i, this: PyQuery(this).text() == 'Current Diagnosis'
-        )
+        curr_diag_el = KsadsUploader._find_anchor(boxes, lambda txt: txt == 'Current Diagnosis')
         # get user information element
-        user_info_el = doc.find('LTTextBoxHorizontal').filter(
-            lambda i, this: PyQuery(this).text() == 'User Information'
-        )
+        user_info_el = KsadsUploader._find_anchor(boxes, lambda txt: txt == 'User Information')
 
         # if user information does not exist
         # use patient ID anchor instead
-        if user_info_el.text() == '':
-            user_info_el = doc.find('LTTextBoxHorizontal').filter(
-                lambda i, this: PyQuery(this).text() == 'PATIENT ID'
-            )
+        if user_info_el is None:
+            user_info_el = KsadsUploader._find_anchor(boxes, lambda txt: txt == 'PATIENT ID')
 
-        # filter to only get information  elements
-        def filter_info_el(i, this, curr_diag_el=curr_diag_el, user_info_el=user_info_el):
-            parents = PyQuery(this).parents()
-            x0 = PyQuery(this).attr('x0')
-            y1 = PyQuery(this).attr('y1')
+        if curr_diag_el is None or user_info_el is None:
+            raise ValueError('Could not find user information anchors')
 
-            # get page of element
-            for ind in range(len(parents)):
-                pg = parents.eq(ind).attr('page_index')
-                if pg is not None:
-                    break
-
-            # if first page => get btw user information & current diagnosis
-            if pg == '0':
-                prop = float(x0) >= float(user_info_el.attr('x0'))
-                prop = prop and float(y1) <= float(user_info_el.attr('y1'))
-                prop = prop and float(y1) > float(curr_diag_el.attr('y1'))
-            # if not first page => filter out
-            else:
-                prop = False
-            return prop
-
-        info_elements = doc.find('LTTextBoxHorizontal').filter(filter_info_el)
-
-        return info_elements
+        # only get elements on first page btw user information & current diagnosis
+        pgs, x0s, y1s = KsadsUploader._box_coords(boxes)
+        mask = (pgs == 0) & (x0s >= user_info_el.x0)
+        mask &= (y1s <= user_info_el.y1) & (y1s > curr_diag_el.y1)
+        return [boxes[i] for i in np.flatnonzero(mask)]
 
     @staticmethod
-    def parse_diag_elements(doc):
+    def parse_diag_elements(boxes):
         """
-        Parses PDF document to only get diagnosis elements
+        Filters the text boxes to only get diagnosis elements
 
-        doc: PDF document
+        boxes: list of Items of the PDF document
 
-        returns: LTTBH elements of diagnoses
+        returns: Items of diagnoses
         """
         # get current diagnosis element
-        curr_diag_el = doc.find('LTTextBoxHorizontal').filter(
-            lambda i, this: PyQuery(this).text() == 'Current Diagnosis'
-        )
+        curr_diag_el = KsadsUploader._find_anchor(boxes, lambda txt: txt == 'Current Diagnosis')
         # get link element
-        link_el = doc.find('LTTextBoxHorizontal').filter(
-            lambda i, this: 'https:' in PyQuery(this).text()
-        )
+        link_el = KsadsUploader._find_anchor(boxes, lambda txt: 'https:' in txt)
         # get CPC element
-        cpc_el = doc.find('LTTextBoxHorizontal').filter(
-            lambda i, this: PyQuery(this).text().startswith('CPC')
-        )
+        cpc_el = KsadsUploader._find_anchor(boxes, lambda txt: txt.startswith('CPC'))
 
-        # filter to only get diagnosis elements
-        def filter_diag_el(i, this, curr_diag_el=curr_diag_el, link_el=link_el, cpc_el=cpc_el):
-            parents = PyQuery(this).parents()
-            x0 = PyQuery(this).attr('x0')
-            y1 = PyQuery(this).attr('y1')
-
-            # get page of element
-            for ind in range(len(parents)):
-                pg = parents.eq(ind).attr('page_index')
-                if pg is not None:
-                    break
+        if curr_diag_el is None:
+            raise ValueError('Could not find current diagnosis anchor')
 
-            # if first page => get btw current diag & link
-            if pg == '0':
-                prop = float(x0) >= float(curr_diag_el.attr('x0'))
-                prop = prop and float(y1) <= float(curr_diag_el.attr('y1'))
-                # if link exists (old format)
-                if link_el.text() != '':
-                    prop = prop and float(y1) > float(link_el.attr('y1'))
-            # if not first page => get btw cpc & link
-            else:
-                prop = float(x0) >= float(curr_diag_el.attr('x0'))
-                # if cpc exists (old format)
-                if cpc_el.text() != '':
-                    prop = prop and float(y1) < float(cpc_el.attr('y1'))
-                # if link exists (old format)
-                if link_el.text() != '':
-                    prop = prop and float(y1) > float(link_el.attr('y1'))
-            # exclude copyright
-            prop = prop and not PyQuery(this).text().startswith("Copyright")
-            # exclude datetime
-            prop = prop and not re.search(r"\d\d?/\d\d?/\d\d\d\d", PyQuery(this).text())
-            return prop
-
-        diag_elements = doc.find('LTTextBoxHorizontal').filter(filter_diag_el)
-
-        return diag_elements
+        # filter to only get diagnosis elements
+        pgs, x0s, y1s = KsadsUploader._box_coords(boxes)
+        first_pg = pgs == 0
+        mask = x0s >= curr_diag_el.x0
+        # if first page => get btw current diag & link
+        mask &= ~first_pg | (y1s <= curr_diag_el.y1)
+        # if not first page => get btw cpc & link
+        # if cpc exists (old format)
+        if cpc_el is not None:
+            mask &= first_pg | (y1s < cpc_el.y1)
+        # if link exists (old format)
+        if link_el is not None:
+            mask &= y1s > link_el.y1
+
+        # exclude copyright & datetime
+        return [
+            boxes[i] for i in np.flatnonzero(mask)
+            if not boxes[i].txt.startswith("Copyright") and not _RE_DATETIME.search(boxes[i].txt)
+        ]
 
     @staticmethod
     def sort_el_coord(elements):
         """
-        Groups the elements into a Item objects
         Returns the list of elements sorted by page, y1, x0
 
-        elements: LTTBH elements
+        elements: list of Items
 
         returns: sorted list of Items
         """
-        items = []
-        for i in range(len(elements)):
-            el = elements.eq(i)
-            x0 = float(el.attr('x0'))
-            y1 = float(el.attr('y1'))
-            pg = int(el.parents('LTPage').attr('page_index'))
-            txt = el.text()
-            item = Item(pg, x0, y1, txt)
-            items.append(item)
-        return sorted(items, key=lambda k: (k.pg, -1 * k.y1, k.x0))
-
-    def parse_data(self, diag_els, info_els, template):
+        pgs, x0s, y1s = KsadsUploader._box_coords(elements)
+        # last key is the primary one
+        order = np.lexsort((x0s, -1 * y1s, pgs))
+        return [elements[i] for i in order]
+
+    @staticmethod
+    def get_column_types(txts):
+        """
+        Classifies the diagnosis columns from the text of their first element
+
+        txts: text of the first element of each column, in x0 order
+
+        returns: array of column types
+        """
+        types = []
+        # unlabeled columns are disorder type, diagnosis, then symptoms
+        unlabeled = iter(('dis_type_x', 'diag_x'))
+
+        for txt in txts:
+            m = _RE_COLUMN_TYPE.match(txt)
+            if m:
+                types.append(m.lastgroup)
+            else:
+                types.append(next(unlabeled, 'symp_x'))
+
+        return np.array(types)
+
+    def _load_template(self):
+        """
+        Reads the template (CSV that contains REDCap variable name and field label)
+        and caches the lookups parse_data derives from it
+        """
+        self._template = pd.read_csv(self._template_path)
+        # lowercase the field labels once so that each case-insensitive match
+        # is a plain substring test instead of a pandas string op
+        self._template_labels = self._template['Field Label'].fillna('').str.lower().to_numpy()
+        self._date_field_name = next(
+            (field for field in self._template['Variable / Field Name'].values if 'date' in field), None
+        )
+        # Section Header matches only depend on the time string, filled as needed
+        self._section_masks = {}
+
+    def parse_data(self, diag_els, info_els):
         """
         diag_items: list of Items containing diagnosis data
         info_items: list of Items containing user information data
-        template: CSV that contains REDCap variable name and field label
 
         Maps extracted data from PDF to corresponding REDCap variable
 
         Returns: dict that maps REDCap variable name to corresponding value extracted from PDF
         """
         redcap_vals = {}
+        template = self._template
+        labels_lower = self._template_labels
 
-        # get all xs
-        diag_xs = sorted(set(x.x0 for x in diag_els))
-        info_xs = sorted(set(x.x0 for x in info_els))
+        # get all xs (only the count is needed so no sorting)
+        info_xs = {x.x0 for x in info_els}
 
         # verify formatting (can be 4 or 5 depending on format version)
-        if 'User Information' in [x.txt for x in info_els]:
+        if any(x.txt == 'User Information' for x in info_els):
             if len(info_xs) != 5:
                 raise ValueError(
                     f"Expected 5 x0 values for info elements, got {len(info_xs)}"
@@ -210,14 +344,14 @@ class KsadsUploader(RedcapUploader):
         subj, event, date_field = None, None, None
         for info_el in info_els:
             txt = info_el.txt
-            if re.match('\d+_\d', txt):
+            # cheap character checks before entering the regex engine
+            if '_' in txt and _RE_ID.match(txt):
                 subj, event = txt.split('_')
                 event = 'year_' + event + '_arm_1'
                 redcap_vals[self.id_field()] = subj
                 redcap_vals[self.event_field()] = event
-            elif re.match('\d\d?/\d\d?/\d\d\d?\d?', txt):
-                date_field = \
-                    template[template['Variable / Field Name'].str.contains('date')]['Variable / Field Name'].values[0]
+            elif '/' in txt and _RE_DATE.match(txt):
+                date_field = self._date_field_name
                 redcap_vals[date_field] = txt
 
         if self.id_field() not in redcap_vals:
@@ -237,45 +371,15 @@ class KsadsUploader(RedcapUploader):
             )
 
         # parse diagnosis data
-        df = pd.DataFrame([[item.pg, item.x0, item.y1, item.txt] for item in diag_els],
-                          columns=['pg', 'x0', 'y1', 'txt'])
-
-        # get indices of element type's x0 in diag_xs
-        def get_idx(df_x_uniq_arg, diag_xs_arg):
-            xs_arr = []
-
-            for _, s in df_x_uniq_arg['txt'].items():
-                if re.match(r"(Current)|(Past) Diagnosis", s):
-                    xs_arr.append('time_x')
-                elif re.match('No diagnosis', s):
-                    xs_arr.append('no_diag_x')
-                elif s.startswith('Symptom'):
-                    xs_arr.append('suicid_symp_x')
-                elif re.match('Description', s):
-                    xs_arr.append('desc_x')
-                elif re.match(r'(C-)?\s?CASA\s?Code', s):
-                    xs_arr.append('casa_x')
-                elif re.match(r'Patient\sComments', s):
-                    xs_arr.append('comments_x')
-                else:
-                    if 'dis_type_x' not in xs_arr:
-                        xs_arr.append('dis_type_x')
-                    elif 'diag_x' not in xs_arr:
-                        xs_arr.append('diag_x')
-                    else:
-                        xs_arr.append('symp_x')
-
-            xs_arr = pd.Series(
-                xs_arr
-            )
+        x0s = np.fromiter((item.x0 for item in diag_els), dtype=np.float64, count=len(diag_els))
+        txts = [item.txt for item in diag_els]
 
-            return xs_arr
+        # get all diagnosis xs, the first element at each of them & the index
+        # of each element's x0 in diag_xs (i.e. its item type's index in xs)
+        diag_xs, first_idx, type_idx = np.unique(x0s, return_index=True, return_inverse=True)
 
-        xs = get_idx(df[~df['x0'].duplicated()].sort_values('x0'), diag_xs)
-
-        # print(df.sort_values(['x0', 'y1']))
-        # print(df[~df['x0'].duplicated()].sort_values('x0'))
-        # print(xs)
+        # get the item type of each diagnosis x0
+        xs = self.get_column_types([txts[idx] for idx in first_idx])
 
         # verify xs match length of diag_xs
         if not len(xs) == len(diag_xs):
@@ -285,6 +389,21 @@ class KsadsUploader(RedcapUploader):
                 f"diagnosis x0s: {diag_xs}"
             )
 
+        # Section Header matches only depend on the time string, so compute
+        # each one once instead of once per row
+        section_masks = self._section_masks
+
+        def section_mask(time_arg, case=True):
+            key = (time_arg, case)
+            if key not in section_masks:
+                section_masks[key] = template['Section Header'].str.contains(
+                    r'\b' + time_arg, case=case, na=False).to_numpy(dtype=bool)
+            return section_masks[key]
+
+        def label_contains(needle):
+            needle = needle.lower()
+            return np.fromiter((needle in label for label in labels_lower), dtype=bool, count=len(labels_lower))
+
         def parse_time_x(txt_arg):
             time_str = txt_arg[:-len(' Diagnosis')]
             return time_str
@@ -292,17 +411,12 @@ class KsadsUploader(RedcapUploader):
         def process_txt(txt_arg):
             txt_processed = txt_arg
             # replace present (occurs after comma or code) with current
-            txt_processed = re.sub(r'[,–-] ?present', ', Current', txt_processed, flags=re.IGNORECASE)
-            txt_processed = re.sub(r'[)] present', '), Current', txt_processed, flags=re.IGNORECASE)
+            txt_processed = _RE_PRESENT_COMMA.sub(', Current', txt_processed)
+            txt_processed = _RE_PRESENT_PAREN.sub('), Current', txt_processed)
             # replace newline with space
-            txt_processed = re.sub('\n', ' ', txt_processed)
+            txt_processed = txt_processed.replace('\n', ' ')
             # replace special characters
-            spec_char = {
-                b'\xef\xac\x81': 'fi',
-                "’".encode('utf-8'): "'"
-            }
-            for k in spec_char.keys():
-                txt_processed = txt_processed.replace(k.decode('utf-8'), spec_char[k])
+            txt_processed = txt_processed.translate(_SPEC_CHARS)
             return txt_processed
 
         def verify_match(ind_arg, template_arg, tokens_arg, txt_arg, txt_processed_arg):
@@ -353,20 +467,20 @@ class KsadsUploader(RedcapUploader):
             curr_vars_arg['diag'] = txt_processed
 
             # find time & match
-            if re.search(r"(\bCurrent)|(\bPast)", txt_processed, re.IGNORECASE):
-                time_str = re.search(r"(\bCurrent)|(\bPast)", txt_processed, re.IGNORECASE).group()
+            time_match = _RE_TIME.search(txt_processed)
+            if time_match:
+                time_str = time_match.group()
             else:
                 time_str = curr_vars_arg['time']
-            ind_arr = template_arg['Section Header'].str.contains(r'\b' + time_str, case=False)
+            ind_arr = section_mask(time_str, case=False).copy()
 
             # find remission & match
-            remission = re.search(
-                r"(full)|(partial) remission", txt_processed, re.IGNORECASE).group() if re.search(
-                r"(full)|(partial) remission", txt_processed, re.IGNORECASE) else ''
+            remission_match = _RE_REMISSION.search(txt_processed)
+            remission = remission_match.group() if remission_match else ''
             if remission:
-                ind_arr &= template_arg['Field Label'].str.contains(remission, case=False)
+                ind_arr &= label_contains(remission)
             else:
-                ind_arr &= ~template_arg['Field Label'].str.contains('remission', case=False)
+                ind_arr &= ~label_contains('remission')
 
             # remove time & remission from txt_processed
             pat = r'(–?' + time_str + ')|(' + remission + ')'
@@ -374,45 +488,42 @@ class KsadsUploader(RedcapUploader):
 
             # split by , ( or ) except in parentheses
             # get tokens
-            tokens_arr = []
-            splits = re.split(r',|\(|\)\s*(?![^()]*\))', txt_processed)
-            for j, el in enumerate(splits):
-                if j == 0:
-                    tokens_arr.append(el.strip())
-                else:
-                    tokens_arr.extend(el.split())
+            tokens_arr = _tokenize_diag(txt_processed)
 
             # special case 1: AD/H other vs AD/H
             if 'Attention-Deficit/Hyperactivity Disorder' in txt_processed:
                 if 'Other' in txt_processed:
-                    ind_arr &= template_arg['Field Label'].str.contains('Other', case=False, regex=False)
+                    ind_arr &= label_contains('Other')
                 else:
-                    ind_arr &= ~template_arg['Field Label'].str.contains('Other', case=False, regex=False)
+                    ind_arr &= ~label_contains('Other')
             # special case 2: if sleep problems => just continue;
             # map based on symptom "patient reported trouble falling asleep"
             # 'insomnia' variable not used?
-            if re.search('sleep problems', txt_processed, re.IGNORECASE) or \
-                    re.search('insomnia', txt_processed, re.IGNORECASE):
+            if _RE_SLEEP_PROBLEMS.search(txt_processed):
                 return redcap_vals_arg, curr_vars_arg
             # special case 3: phobia not part of KSADS
-            if re.search('phobi', txt_processed, re.IGNORECASE):
+            if _RE_PHOBIA.search(txt_processed):
                 return redcap_vals_arg, curr_vars_arg
             # special case 4: adjustment disorder not part of KSADS
-            if re.search('adjustment disorder', txt_processed, re.IGNORECASE):
+            if _RE_ADJUSTMENT.search(txt_processed):
                 return redcap_vals_arg, curr_vars_arg
             # special case 7: disruptive mood dysregulation has no time
-            if re.search('disruptive mood dysregulation', txt_processed, re.IGNORECASE):
-                ind_arr |= ~template_arg['Section Header'].str.contains(r'\b' + time_str, case=False)
+            if _RE_DMDD.search(txt_processed):
+                ind_arr |= ~section_mask(time_str, case=False)
             # special case 8: bipolar I disorder has no remission
-            if re.search('bipolar I disorder', txt_processed, re.IGNORECASE):
-                ind_arr |= ~template_arg['Field Label'].str.contains(remission, case=False)
+            if _RE_BIPOLAR_I.search(txt_processed):
+                ind_arr |= ~label_contains(remission)
 
 
-            # match tokens
+            # match tokens, only probing the rows that still match
+            cand = np.flatnonzero(ind_arr)
             for token in tokens_arr:
-                ind_arr &= template_arg['Field Label'].str.contains(token, case=False, regex=False)
-                if ind_arr.sum() == 1:
+                token = token.lower()
+                cand = cand[np.fromiter((token in labels_lower[j] for j in cand), dtype=bool, count=len(cand))]
+                if len(cand) == 1:
                     break
+            ind_arr = np.zeros(len(labels_lower), dtype=bool)
+            ind_arr[cand] = True
 
             # verify match
             verify_match(ind_arg=ind_arr, template_arg=template_arg, tokens_arg=tokens_arr, txt_arg=txt_arg,
@@ -432,12 +543,11 @@ class KsadsUploader(RedcapUploader):
 
             # extract symptom, time
             symp = tokens[0]
-            time_matches = re.findall(r"(\bCurrent)|(\bPast)", re.sub(r' \([^)]*\)', '', txt_processed),
-                                      flags=re.IGNORECASE)
+            time_matches = _RE_TIME.findall(_RE_PARENTHESES.sub('', txt_processed))
 
             # verify at most 1 time value
             if len(time_matches) > 1:
-                sub = re.sub(r' \([^)]*\)', '', txt_arg)
+                sub = _RE_PARENTHESES.sub('', txt_arg)
                 raise ValueError(
                     f"Expected at most 1 value of time from symptom\n" +
                     f"{time_matches}\n{txt_processed}\n{sub}"
@@ -450,87 +560,72 @@ class KsadsUploader(RedcapUploader):
                 time_str = curr_vars_arg['time'].strip()
 
             # find field label with symptom & time
-            ind_arr = template_arg['Field Label'].str.contains(symp, case=False, regex=False)
-            ind_arr &= template_arg['Section Header'].str.contains(r'\b' + time_str)
+            ind_arr = label_contains(symp)
+            ind_arr &= section_mask(time_str)
 
             # special case 1: stealing
-            if re.search('stealing', symp, re.IGNORECASE):
+            if _RE_STEALING.search(symp):
                 if 'confronting' in symp:
-                    ind_arr &= template_arg['Field Label'].str.contains('confronting', case=False, regex=False)
+                    ind_arr &= label_contains('confronting')
                 else:
-                    ind_arr &= ~template_arg['Field Label'].str.contains('confronting', case=False, regex=False)
+                    ind_arr &= ~label_contains('confronting')
             # special case 2: irritability vs explosive irritability vs manic irritability
-            if re.search('irritability', symp, re.IGNORECASE):
+            if _RE_IRRITABILITY.search(symp):
                 if 'Explosive' in txt_processed:
-                    ind_arr &= template_arg['Field Label'].str.contains('Explosive', case=False, regex=False)
+                    ind_arr &= label_contains('Explosive')
                 elif 'Manic' in txt_processed:
-                    ind_arr &= template_arg['Field Label'].str.contains('Manic', case=False, regex=False)
+                    ind_arr &= label_contains('Manic')
                 else:
-                    ind_arr &= ~template_arg['Field Label'].str.contains('Explosive', case=False, regex=False)
-                    ind_arr &= ~template_arg['Field Label'].str.contains('Manic', case=False, regex=False)
+                    ind_arr &= ~label_contains('Explosive')
+                    ind_arr &= ~label_contains('Manic')
             # special case 3: suicidal ideation as symptom
-            if re.match('^suicidal ideation$', symp, re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.fullmatch(
-                    '^suicidal ideation: ' + time_str + '$',
-                    case=False
-                )
+            if _RE_SUICIDAL_IDEATION.match(symp):
+                ind_arr = labels_lower == ('suicidal ideation: ' + time_str).lower()
             # special case 4: sleep problem => map to text
-            if re.search('Patient reported trouble falling asleep or staying asleep', symp, re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.contains('sleep problems', case=False, regex=False)
+            if _RE_TROUBLE_SLEEPING.search(symp):
+                ind_arr = label_contains('sleep problems')
                 # use time from time_x since contains "past"
-                ind_arr &= template_arg['Section Header'].str.contains(r'\b' + curr_vars_arg['time'])
+                ind_arr &= section_mask(curr_vars_arg['time'])
                 mapText = True
             # special case 5: phobia not part of KSADS
-            if re.search('phobi', symp, re.IGNORECASE):
+            if _RE_PHOBIA.search(symp):
                 return redcap_vals_arg
             # special case 6: adjustment disorder not part of KSADS
             # adjustment disorder symptom if diag == adjustment disorder and no symptoms matched
-            if ind_arr.sum() == 0 and re.search('adjustment disorder', curr_vars_arg['diag'], re.IGNORECASE):
+            if ind_arr.sum() == 0 and _RE_ADJUSTMENT.search(curr_vars_arg['diag']):
                 return redcap_vals_arg
             # special case 7: disruptive mood dysregulation symptoms don't have time
             if ind_arr.sum() == 0 and \
-                    re.search('disruptive mood dysregulation', curr_vars_arg['diag'], re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.contains(symp, case=False, regex=False)
+                    _RE_DMDD.search(curr_vars_arg['diag']):
+                ind_arr = label_contains(symp)
             # special case 8: 'Difficulty sustaining attention since elementary school'
             # vs 'more than one school year'
-            if re.search('Difficulty sustaining', symp, re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.contains(
-                    'Difficulty sustaining',
-                    case=False, regex=False
-                )
-                ind_arr &= template_arg['Section Header'].str.contains(r'\b' + time_str)
+            if _RE_SUSTAINING.search(symp):
+                ind_arr = label_contains('Difficulty sustaining')
+                ind_arr &= section_mask(time_str)
             # special case 9: 'Easily distracted since elementary school'
             # vs 'for more than one school year'
-            if re.search('easily distracted', symp, re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.contains(
-                    'easily distracted',
-                    case=False, regex=False
-                )
-                ind_arr &= template_arg['Section Header'].str.contains(r'\b' + time_str)
+            if _RE_DISTRACTED.search(symp):
+                ind_arr = label_contains('easily distracted')
+                ind_arr &= section_mask(time_str)
             # special case 10: 'Difficulty remaining seated since elementary school'
             # vs 'for more than one school year'
-            if re.search('Difficulty remaining seated', symp, re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.contains(
-                    'Difficulty remaining seated',
-                    case=False, regex=False
-                )
-                ind_arr &= template_arg['Section Header'].str.contains(r'\b' + time_str)
+            if _RE_SEATED.search(symp):
+                ind_arr = label_contains('Difficulty remaining seated')
+                ind_arr &= section_mask(time_str)
             # special case 11: elevated / euphoric mood => elevated mood
-            if re.search('Elevated', symp, re.IGNORECASE) and re.search('mood', symp, re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.contains(
-                    'Elevated mood:',
-                    case=False, regex=False
-                )
-                ind_arr &= template_arg['Section Header'].str.contains(r'\b' + time_str)
+            if _RE_ELEVATED.search(symp) and _RE_MOOD.search(symp):
+                ind_arr = label_contains('Elevated mood:')
+                ind_arr &= section_mask(time_str)
             # special case 12: hypersexuality
-            if re.search('Hypersexuality', symp, re.IGNORECASE):
+            if _RE_HYPERSEXUALITY.search(symp):
                 return redcap_vals_arg
             # special case 13: distractibility vs increased distractibility
-            if re.search('distractibility', symp, re.IGNORECASE):
+            if _RE_DISTRACTIBILITY.search(symp):
                 if 'Increased' in symp:
-                    ind_arr &= template_arg['Field Label'].str.contains('increased', case=False, regex=False)
+                    ind_arr &= label_contains('increased')
                 else:
-                    ind_arr &= ~template_arg['Field Label'].str.contains('increased', case=False, regex=False)
+                    ind_arr &= ~label_contains('increased')
             # special case 14: NOTE: has no match
             if symp.startswith('NOTE: '):
                 return redcap_vals_arg
@@ -552,26 +647,23 @@ class KsadsUploader(RedcapUploader):
             txt_processed = txt_processed.replace('Self- ', 'Self-')
 
             # get time
-            if re.search(r"(\bCurrent)|(\bPast)", txt_processed, re.IGNORECASE):
-                time = re.search(r"(\bCurrent)|(\bPast)", txt_processed, re.IGNORECASE).group()
+            time_match = _RE_TIME.search(txt_processed)
+            if time_match:
+                time = time_match.group()
             else:
                 time = curr_vars_arg['time']
 
             # match txt with field
-            ind_arr = template_arg['Field Label'].str.contains(txt_processed, case=False, regex=False)
-            ind_arr &= template_arg['Field Label'].str.contains(time, case=False, regex=False)
+            ind_arr = label_contains(txt_processed)
+            ind_arr &= label_contains(time)
 
             # special case 1: "suicide attempt" matches multiple
-            if re.match('^suicide attempt$', txt_processed.strip(), re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.fullmatch(
-                    '^' + time + ' suicide attempt$',
-                    case=False
-                )
+            if _RE_SUICIDE_ATTEMPT.match(txt_processed.strip()):
+                ind_arr = labels_lower == (time + ' suicide attempt').lower()
             # special case 2: preparatory actions toward imminent suicidal behavior
-            prep_act_str = 'preparatory actions toward imminent suicidal behavior'
-            if re.search(prep_act_str, txt_processed.strip(), re.IGNORECASE):
-                ind_arr = template_arg['Field Label'].str.contains(prep_act_str, case=False, regex=False)
-                ind_arr &= template_arg['Section Header'].str.contains(r'\b' + time, case=False)
+            if _RE_PREP_ACT.search(txt_processed.strip()):
+                ind_arr = label_contains(_PREP_ACT_STR)
+                ind_arr &= section_mask(time, case=False)
 
             # verify match
             verify_match(ind_arr, template_arg, tokens_arg=None, txt_arg=txt_arg, txt_processed_arg=txt_processed)
@@ -595,7 +687,7 @@ class KsadsUploader(RedcapUploader):
 
         def parse_suicide_casa_x(txt_arg, curr_vars_arg, redcap_vals_arg):
             # just header
-            if re.search(r'C-\s?CASA\s?Code', txt_arg):
+            if _RE_CCASA.search(txt_arg):
                 return redcap_vals_arg
 
             # get casa code
@@ -605,7 +697,7 @@ class KsadsUploader(RedcapUploader):
 
         def parse_suicide_comments_x(txt_arg, curr_vars_arg, redcap_vals_arg):
             # just header
-            if re.search(r'Patient\sComments', txt_arg):
+            if _RE_COMMENTS.search(txt_arg):
                 return redcap_vals_arg
 
             # get patient comments
@@ -613,14 +705,12 @@ class KsadsUploader(RedcapUploader):
             redcap_vals_arg[suicide_field].append('Patient Comments: ' + txt_arg.replace('\n', ' '))
             return redcap_vals_arg
 
+        # item type of every row
+        item_types = xs[type_idx]
+
         suicide_fields = []
         curr_vars = {}
-        for i, row in df.iterrows():
-            txt = row['txt']
-            # get item type
-            for idx, item_type in xs.items():
-                if diag_xs[int(idx)] == row['x0']:
-                    break
+        for txt, item_type in zip(txts, item_types):
             # print(txt, item_type)
             # get time
             if item_type == 'time_x':
@@ -655,29 +745,34 @@ class KsadsUploader(RedcapUploader):
     def pull(self):
         errors = []
         pulled_data = []
+        field_names = frozenset(self.field_names())
+        id_field, event_field = self.id_field(), self.event_field()
+
+        # lay out the pdfs, in parallel if there are enough of them; reports
+        # are independent and the layout analysis is the bulk of the parsing
+        report_paths = [report.report_path for report in self._reports.values()]
+        if len(report_paths) < _MIN_POOL_REPORTS:
+            report_boxes = [_load_text_boxes(path) for path in report_paths]
+        else:
+            max_workers = min(os.cpu_count() or 1, len(report_paths))
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                report_boxes = list(executor.map(_load_text_boxes, report_paths))
 
         # Iterate over timepoints
-        for (subj, event), report in self._reports.items():
-            # load pdf
-            pdf = pdfquery.PDFQuery(report.report_path)
-            pdf.load()
-            # convert the pdf to XML
-            # pdf.tree.write('test.xml', pretty_print=True)
-            doc = pdf.pq
+        for ((subj, event), report), boxes in zip(self._reports.items(), report_boxes):
             # parse pdf & sort elements
             try:
-                diag_els = self.sort_el_coord(self.parse_diag_elements(doc))
-                info_els = self.sort_el_coord(self.parse_info_elements(doc))
-            except TypeError as err:
+                diag_els = self.sort_el_coord(self.parse_diag_elements(boxes))
+                info_els = self.sort_el_coord(self.parse_info_elements(boxes))
+            except (TypeError, ValueError) as err:
                 errors.append(
                     KsadsUploaderError(str(err), subj_id=subj, event=event, form_path=report.report_path)
                 )
                 # raise err
                 continue
 
-            template = pd.read_csv(self._template_path)
             try:
-                redcap_vals = self.parse_data(diag_els, info_els, template)
+                redcap_vals = self.parse_data(diag_els, info_els)
             except ValueError as err:
                 errors.append(
                     KsadsUploaderError(str(err), subj_id=subj, event=event, form_path=report.report_path)
@@ -692,24 +787,19 @@ class KsadsUploader(RedcapUploader):
                 # raise err
             else:
                 # verify subj, event matches, youth vs parent
-                pdf_subj, pdf_event = redcap_vals[self.id_field()], redcap_vals[self.event_field()]
-
-                # function to get source element
-                def get_source_element(element):
-                    if element.txt in ['Parent', 'Youth', 'Teen']:
-                        return True
-                    return False
+                pdf_subj, pdf_event = redcap_vals[id_field], redcap_vals[event_field]
 
+                info_txt = tuple(el.txt for el in info_els)
                 try:
                     # get source
-                    filtered = list(filter(get_source_element, info_els))
-                    if len(filtered) != 1:
+                    sources = [txt for txt in info_txt if txt in _KSADS_SOURCES]
+                    if len(sources) != 1:
                         raise KsadsUploaderError(
-                            f'Error parsing source information: {[i.txt for i in filtered]}',
+                            f'Error parsing source information: {sources}',
                             subj_id=subj, event=event, form_path=report.report_path
                         )
                     else:
-                        pdf_source = 'P' if filtered[0].txt == 'Parent' else 'Y'
+                        pdf_source = 'P' if sources[0] == 'Parent' else 'Y'
                     # verify subj
                     if pdf_subj != subj:
                         raise KsadsUploaderError(
@@ -724,22 +814,29 @@ class KsadsUploader(RedcapUploader):
                             f'match the provided timepoint.', subj_id=subj,
                             event=event, form_path=report.report_path
                         )
-                    source = os.path.split(report.report_path)[-1][0]
+                    source = os.path.basename(report.report_path)[0]
                     # verify source
                     if pdf_source != source:
                         raise KsadsUploaderError(
-                            f'Form source must match: {source} vs {pdf_source, info_els[3].txt} ',
+                            f'Form source must match: {source} vs {pdf_source, info_txt[3]} ',
                             subj_id=subj, event=event, form_path=report.report_path
                         )
                 except KsadsUploaderError as err:
                     errors.append(err)
                     continue
 
-                # skip if already complete
+                # verify all cols exist & skip if already complete, in one
+                # pass; the first field stands in for its form's status
                 try:
                     skip = False
-                    for field in redcap_vals:
-                        if field == self.id_field() or field == self.event_field():
+                    form_marked = False
+                    bad_redcap_fields = []
+                    for field in list(redcap_vals):
+                        if field == id_field or field == event_field:
+                            continue
+                        elif field not in field_names:
+                            bad_redcap_fields.append(field)
+                        elif form_marked:
                             continue
                         elif (self._skip_complete and
                               self.is_complete(subj, event, field)):
@@ -748,20 +845,13 @@ class KsadsUploader(RedcapUploader):
                         else:
                             completed_field = self.completed_field(field)
                             redcap_vals[completed_field] = self._uploaded_status
-                            break
+                            form_marked = True
                     if skip:
                         continue
                 except RedcapUploaderError as err:
                     errors.append(err)
                     continue
 
-                # verify all cols exist
-                bad_redcap_fields = []
-                for field in redcap_vals.keys():
-                    if field == self.id_field() or field == self.event_field():
-                        continue
-                    elif field not in self.field_names():
-                        bad_redcap_fields.append(field)
                 if bad_redcap_fields:
                     raise ValueError(
                         'These field(s) do not exist in the REDCap database:\n' +
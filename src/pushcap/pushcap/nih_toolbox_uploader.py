@@ -2,11 +2,34 @@ import csv
 import code
 from datetime import datetime
 from dateutil.parser import parse as dateparse
+from functools import lru_cache
 from pathlib import Path
 import re
 
 from . import RedcapUploader, RedcapUploaderError
 
+_REDCAP_RE = re.compile(r'^\{([A-Za-z0-9_]+)\}'
+                        r'(?:\((datetime|constant) (.+)\))?$')
+_STRIP_0S_RE = re.compile(r'^(-?\d+)(?:(?:(\.\d*[1-9])0+)|(?:\.0+))$')
+
+
+def _strip_0s(x):
+    return _STRIP_0S_RE.sub(r'\1\2', x)
+
+
+def _make_datetime_fn(fmt):
+    # Bind fmt per template entry; dates repeat across rows and reports, so
+    # cache the parsed & formatted result
+    @lru_cache(maxsize=1024)
+    def fn(x):
+        return dateparse(x).strftime(fmt)
+    return fn
+
+
+def _make_constant_fn(constant):
+    return lambda: constant
+
+
 class NIHToolboxUploader(RedcapUploader):
     def __init__(self, reports, template_path, api_url, token, log_path,
                  date_fields=None, skip_complete=True, uploaded_status=None,
@@ -56,15 +79,16 @@ class NIHToolboxUploader(RedcapUploader):
     def pull(self):
         errors = []
         pulled_data = []
+        overwrite_ok = frozenset(self._overwrite_ok)
         for (subj_id, event) in self._reports:
             csv_paths = self._reports[(subj_id, event)].score_paths
             try:
                 data = self.parse_csv(subj_id, event, csv_paths[0])
                 for extra_csv in csv_paths[1:]:
                     extra_data = self.parse_csv(subj_id, event, extra_csv)
-                    dupes = [k for k in extra_data.keys() if k in data.keys()
-                             and k not in self._overwrite_ok
-                             and not k.endswith('_complete')]
+                    dupes = sorted(k for k in (extra_data.keys() & data.keys())
+                                   - overwrite_ok
+                                   if not k.endswith('_complete'))
                     if dupes:
                         raise NIHTbUploaderError(
                                 'Multiple values from different scoring files '
@@ -99,15 +123,27 @@ class NIHToolboxUploader(RedcapUploader):
         print(f'Parsing {subj_id}, {event}...')
         redcap_vals = {}
         overwrites = []
+        if self._skip_complete:
+            completed_forms = self.completed_forms(subj_id, event)
 
         with open(csv_path, encoding='utf-8-sig') as csv_file:
-            for r in csv.DictReader(csv_file):
-                try:
-                    instr = r['Inst']
-                except KeyError:
+            reader = csv.reader(csv_file)
+            header = next(reader, [])
+            # Column indices by name (last one wins, as with DictReader)
+            col_idx = {name: idx for idx, name in enumerate(header)}
+            inst_idx = col_idx.get('Inst')
+            # Per instrument translation tuples with csv column indices
+            instr_cols = {}
+
+            for r in reader:
+                # Skip blank lines, as DictReader does
+                if not r:
+                    continue
+                if inst_idx is None:
                     raise NIHTbUploaderError(
                             'No Inst column.', subj_id=subj_id, event=event,
                             form_path=csv_path)
+                instr = r[inst_idx]
 
                 # Skip summary, instructions, "intros", and extra header rows
                 # Skip summary, instructions, "intros", and extra header rows
@@ -120,25 +156,34 @@ class NIHToolboxUploader(RedcapUploader):
 
                 # code.interact(local=locals())
 
-                if subj_id not in r['PIN']:
-                    print(f'PIN mismatch (ID: {subj_id}, PIN: {r["PIN"]})')
+                pin = r[col_idx['PIN']]
+                if subj_id not in pin:
+                    print(f'PIN mismatch (ID: {subj_id}, PIN: {pin})')
                     raise NIHTbUploaderError(
-                            f'PIN mismatch (ID: {subj_id}, PIN: {r["PIN"]})',
+                            f'PIN mismatch (ID: {subj_id}, PIN: {pin})',
                             subj_id=subj_id, event=event,
                             form_path=csv_path)
-                if instr not in self._rcmap.keys():
+                if instr not in self._rcmap:
                     raise NIHTbUploaderError(
                             f'Unknown instrument {instr}.', subj_id=subj_id,
                             event=event, form_path=csv_path)
 
-                for csv_field, redcap_field, translate in self._rcmap[instr]:
+                if instr not in instr_cols:
+                    instr_cols[instr] = [
+                        (col_idx.get(csv_field), csv_field, redcap_field,
+                         translate)
+                        for csv_field, redcap_field, translate
+                        in self._rcmap[instr]
+                    ]
+
+                for csv_idx, csv_field, redcap_field, translate in instr_cols[instr]:
                     if (redcap_field in redcap_vals.keys()
                             and redcap_field not in self._overwrite_ok):
                         overwrites += [redcap_field]
                         continue
 
                     if (self._skip_complete and
-                        self.is_complete(subj_id, event, redcap_field)):
+                        self.field_form(redcap_field) in completed_forms):
                         continue
                     else:
                         completed_field = self.completed_field(redcap_field)
@@ -150,13 +195,12 @@ class NIHToolboxUploader(RedcapUploader):
                         redcap_vals[redcap_field] = translate()
                         continue
 
-                    try:
-                        redcap_vals[redcap_field] = translate(r[csv_field])
-                    except KeyError:
+                    if csv_idx is None:
                         raise NIHTbUploaderError(
                             f'Missing column {csv_field} for {instr}.',
                             subj_id=subj_id, event=event,
                             form_path=csv_path)
+                    redcap_vals[redcap_field] = translate(r[csv_idx])
             
         if overwrites:
             raise NIHTbUploaderError(
@@ -221,16 +265,11 @@ class NIHToolboxUploader(RedcapUploader):
         Raises ValueError if any non-empty row value does not match the template
         file specifications.
         """
-        redcap_re = re.compile(r'^\{([A-Za-z0-9_]+)\}'
-                               r'(?:\((datetime|constant) (.+)\))?$')
-        strip_0s = lambda x: re.sub(r'^(-?\d+)(?:(?:(\.\d*[1-9])0+)|(?:\.0+))$',
-                                     r'\1\2', x)
-
         xlate_tuples = []
         for csv_field, val in csv_row_dict.items():
             if (csv_field == 'Inst') or not val: continue
 
-            match = redcap_re.match(val)
+            match = _REDCAP_RE.match(val)
             if val and not match:
                 raise ValueError(f'Invalid template spec: {val}')
 
@@ -247,13 +286,11 @@ class NIHToolboxUploader(RedcapUploader):
 
             # Translation function
             if not match.group(2):
-                fn = strip_0s
+                fn = _strip_0s
             elif match.group(2) == 'datetime':
-                fmt = match.group(3)
-                fn = lambda x : dateparse(x).strftime(fmt)
+                fn = _make_datetime_fn(match.group(3))
             elif match.group(2) == 'constant':
-                constant = match.group(3)
-                fn = lambda : constant
+                fn = _make_constant_fn(match.group(3))
 
             xlate_tuples.append((csv_field, match.group(1), fn))
 
@@ -1,4 +1,7 @@
+from collections import OrderedDict
 import csv
+from functools import lru_cache
+import os
 from pathlib import Path
 import re
 import subprocess
@@ -12,6 +15,12 @@ import platform
 __SOFFICE__ = '/Applications/LibreOffice.app/Contents/MacOS/soffice'
 __SOFFICEWIN__ = r'C:\Program Files\LibreOffice\program\soffice'
 
+_AGE_RE = re.compile(r'(<)?(\d+):(\d+)(\+)?')
+
+# Most score documents kept loaded during a pull; each is a whole lxml tree,
+# and reports sharing a score file are rare
+_DOC_CACHE_SIZE = 4
+
 
 class QGlobalUploader(RedcapUploader):
     """Uploader for QGlobal .doc scoring files.
@@ -69,12 +78,15 @@ class QGlobalUploader(RedcapUploader):
     def pull(self):
         errors = []
         pulled_data = []
+        # Recently loaded score documents, so that a score file shared by
+        # several reports is opened (and converted from .doc) only once
+        doc_cache = OrderedDict()
 
         for (subj_id, event), report in self._reports.items():
             print(f'Pulling {subj_id}, {event}, {report.report_path}')
             try:
                 data = self._parse_score_file(report.report_path,
-                                              subj_id, event)
+                                              subj_id, event, doc_cache)
                 print(f'Parsing for {subj_id}, {event} successful')
             except RedcapUploaderError as err:
                 errors.append(err)
@@ -98,25 +110,62 @@ class QGlobalUploader(RedcapUploader):
         identified by that table index, row name, and column name will be mapped
         to the REDCap variable rc_var.
 
+        A row_name starting with ': ' names a value labelled `<row_name>:`
+        inside the target column's cells rather than a row. Escaped newlines
+        are unescaped and those anchor patterns compiled here, once per
+        template, instead of for every score file.
+
         Returns:
             A dictionary that maps REDCap variable names to the appropriate
             table index, column, and row, identified by a tuple (table_index,
-            column_name, row_name).
+            column_name, row_name). 'anchor_re' is the compiled pattern for
+            an in-cell value, None for a standard row.
         """
+        rc_map = {}
         with open(self._template_path) as template_file:
-            rc_map = {
-                    r['rc_var']: {'table_idx': int(r['table_idx']),
-                                  'row_name': r['row_name'],
-                                  'col_name': r['col_name'],
-                                  'header_offset': int(r['header_offset']),
-                                  'optional_field': r['optional_field'] != '0',
-                                  'convert_age': r['convert_age'] != '0'}
-                    for r in csv.DictReader(template_file)
-            }
+            for r in csv.DictReader(template_file):
+                row_name = r['row_name'].replace('\\n', '\n')
+                if row_name.startswith(': '):
+                    row_name = row_name[2:]
+                    anchor_re = _anchor_re(row_name)
+                else:
+                    anchor_re = None
+                rc_map[r['rc_var']] = {
+                        'table_idx': int(r['table_idx']),
+                        'row_name': row_name,
+                        'col_name': r['col_name'].replace('\\n', '\n'),
+                        'anchor_re': anchor_re,
+                        'header_offset': int(r['header_offset']),
+                        'optional_field': r['optional_field'] != '0',
+                        'convert_age': r['convert_age'] != '0'}
 
         return rc_map
 
-    def _parse_score_file(self, score_path, subj_id, event):
+    def _load_doc(self, score_path, doc_cache):
+        """Loads a score file as a docx.Document, converting .doc files.
+
+        Documents are cached by resolved path and modification time, keeping
+        only the _DOC_CACHE_SIZE most recently used. docx.Document reads the
+        whole file into memory, so the temporary directory of a conversion can
+        be cleaned up as soon as the document is loaded.
+
+        Arguments:
+            score_path: Path to the score file.
+            doc_cache: OrderedDict of the documents loaded so far in this pull.
+
+        Returns:
+            The docx.Document of the score file.
+        """
+        try:
+            cache_key = (Path(score_path).resolve(),
+                         os.stat(score_path).st_mtime_ns)
+        except FileNotFoundError:
+            raise QGlobalUploaderError('Scoring file not found.',
+                                       form_path=score_path)
+        if cache_key in doc_cache:
+            doc_cache.move_to_end(cache_key)
+            return doc_cache[cache_key]
+
         try:
             score_doc = docx.Document(score_path)
         except (ValueError, BadZipFile):
@@ -129,44 +178,71 @@ class QGlobalUploader(RedcapUploader):
                 raise QGlobalUploaderError('Scoring file not found.',
                                            form_path=score_path)
 
+        doc_cache[cache_key] = score_doc
+        if len(doc_cache) > _DOC_CACHE_SIZE:
+            doc_cache.popitem(last=False)
+        return score_doc
+
+    def _parse_score_file(self, score_path, subj_id, event, doc_cache):
+        score_doc = self._load_doc(score_path, doc_cache)
+        # Document.tables wraps every table of the body on each access
+        tables = score_doc.tables
+
         rc_vals = {}
+        # Text of every cell by table index, read once per table since
+        # python-docx re-walks the XML on every cell access
+        tables_text = {}
+        # Column index of each header text by (table index, header offset),
+        # using the first column if a header text repeats
+        header_maps = {}
+        # Row of each first-column text by table index, using the first row
+        # if a row name repeats
+        row_maps = {}
 
         print(f'Parsing {subj_id}, {event}')
 
+        if self._skip_complete:
+            completed_forms = self.completed_forms(subj_id, event)
+
         for rc_var, rc_var_info in self._rc_map.items():
             if ( self._skip_complete and
-                 self.is_complete(subj_id, event, rc_var) ):
+                 self.field_form(rc_var) in completed_forms ):
                 continue
 
             table_idx = rc_var_info['table_idx']
-            row_name = rc_var_info['row_name'].replace('\\n', '\n')
-            col_name = rc_var_info['col_name'].replace('\\n', '\n')
-            table = score_doc.tables[table_idx]
-            header_row = table.rows[rc_var_info['header_offset']].cells
+            row_name = rc_var_info['row_name']
+            col_name = rc_var_info['col_name']
+            anchor_re = rc_var_info['anchor_re']
+            if table_idx not in tables_text:
+                tables_text[table_idx] = read_table_text(tables[table_idx])
+            table_text = tables_text[table_idx]
+            header_row = table_text[rc_var_info['header_offset']]
 
             # Special case: looking for a value inside a cell
-            if row_name.startswith(': '):
-                col_idx = [idx for idx, cell in enumerate(header_row)
-                           if col_name in cell.text]
+            # Use the first one even if there are multiple
+            if anchor_re is not None:
+                col_idx = next((idx for idx, cell_text in enumerate(header_row)
+                                if col_name in cell_text), None)
             else:
-                col_idx = [idx for idx, cell in enumerate(header_row)
-                           if cell.text == col_name]
-
-            if len(col_idx) == 0:
+                header_key = (table_idx, rc_var_info['header_offset'])
+                if header_key not in header_maps:
+                    header_map = {}
+                    for idx, cell_text in enumerate(header_row):
+                        header_map.setdefault(cell_text, idx)
+                    header_maps[header_key] = header_map
+                col_idx = header_maps[header_key].get(col_name)
+
+            if col_idx is None:
                 raise QGlobalUploaderError(
                     f'No column {col_name} in table {table_idx}.',
                     subj_id=subj_id, event=event, form_path=score_path
                 )
-            else:
-                # Use the first one even if there are multiple
-                col_idx = col_idx[0]
 
             # Find the row and value
             # Special case: looking for a value inside a cell
-            if row_name.startswith(': '):
-                anchor_re = re.compile(f'[\n\t]?{row_name[2:]}:(.+)[\t\n]?')
-                for row in table.rows:
-                    anchor_match = anchor_re.search(row.cells[col_idx].text)
+            if anchor_re is not None:
+                for row_text in table_text:
+                    anchor_match = anchor_re.search(row_text[col_idx])
                     if anchor_match:
                         rc_vals[rc_var] = anchor_match.group(1).strip()
                         if rc_var_info['convert_age']:
@@ -174,18 +250,22 @@ class QGlobalUploader(RedcapUploader):
                         break
                 else:
                     raise QGlobalUploaderError(
-                            f'{row_name[2:]} not found in {col_name}.',
+                            f'{row_name} not found in {col_name}.',
                             subj_id=subj_id, event=event, form_path=score_path)
 
             # Standard case
             else:
-                for row in table.rows:
-                    row_text = [cell.text for cell in row.cells]
-                    if row_text[0] == row_name:
-                        rc_vals[rc_var] = row_text[col_idx].strip()
-                        if rc_var_info['convert_age']:
-                            rc_vals[rc_var] = convert_age(rc_vals[rc_var])
-                        break
+                if table_idx not in row_maps:
+                    row_map = {}
+                    for row_text in table_text:
+                        if row_text:
+                            row_map.setdefault(row_text[0], row_text)
+                    row_maps[table_idx] = row_map
+                row_text = row_maps[table_idx].get(row_name)
+                if row_text is not None:
+                    rc_vals[rc_var] = row_text[col_idx].strip()
+                    if rc_var_info['convert_age']:
+                        rc_vals[rc_var] = convert_age(rc_vals[rc_var])
                 else:
                     if not rc_var_info['optional_field']:
                         raise QGlobalUploaderError(
@@ -214,8 +294,49 @@ class QGlobalUploader(RedcapUploader):
         self._log_path = new_log_path
 
 
+def read_table_text(table):
+    """Reads the text of every cell of a Word table straight from its XML.
+
+    Matches [[cell.text for cell in row.cells] for row in table.rows] without
+    constructing python-docx Row/Cell/Paragraph objects: a cell spanning
+    several grid columns is repeated for each, and a vertically merged cell
+    takes the text of the cell above it.
+
+    Arguments:
+        table: docx.table.Table to read.
+
+    Returns:
+        A list of rows, each a list of cell text strings.
+    """
+    rows_text = []
+    # Text of the previous row's cells by grid column, for vertical merges
+    above = {}
+    for tr in table._tbl.tr_lst:
+        row_text = []
+        row_by_col = {}
+        grid_col = tr.grid_before
+        for tc in tr.tc_lst:
+            if tc.vMerge == 'continue':
+                text = above[grid_col]
+            else:
+                text = '\n'.join(p.text for p in tc.p_lst)
+            for _ in range(tc.grid_span):
+                row_text.append(text)
+                row_by_col[grid_col] = text
+                grid_col += 1
+        rows_text.append(row_text)
+        above = row_by_col
+    return rows_text
+
+
+def _anchor_re(anchor):
+    """Compiles the pattern for a value labelled `<anchor>:` inside a cell."""
+    return re.compile(f'[\n\t]?{re.escape(anchor)}:(.+)[\t\n]?')
+
+
+@lru_cache(maxsize=4096)
 def convert_age(age):
-    age_match = re.fullmatch(r'(<)?(\d+):(\d+)(\+)?', age)
+    age_match = _AGE_RE.fullmatch(age)
     if not age_match:
         raise ValueError(f'{age} does not match the pattern <years>:<months>.')
 
@@ -1,7 +1,21 @@
+import codecs
+from concurrent.futures import ProcessPoolExecutor
 import csv
+from functools import lru_cache
+import io
+from itertools import chain, repeat
+import os
+from pathlib import Path
 
 from . import RedcapUploader, RedcapUploaderError
 
+# qint_reader parse states
+_SEEK_GROUP, _EXPECT_BLANK, _EXPECT_HEADER, _IN_SCORES, _SKIP_SCORES = range(5)
+
+# Fewest reports worth starting worker processes for; the files are small, so
+# below this spawning & pickling costs more than the parsing itself
+_MIN_POOL_REPORTS = 50
+
 class QInteractiveUploader(RedcapUploader):
     def __init__(self, reports, template_path, api_url, token, log_path,
                  info_mappings=None, date_fields=None, uploaded_status=None,
@@ -27,57 +41,88 @@ class QInteractiveUploader(RedcapUploader):
         self._rcmap = {}
         for group, test, col, field in qint_reader(template_path):
             if field:
-                if field[0] != '[' or field[-1] != ']':
+                if not (field.startswith('[') and field.endswith(']')):
                     raise ValueError(
                             f'Template parse error at ({group}, {test}, '
                             f'{col}): expecting bracketed REDCap field.')
                 self._rcmap[(group, test, col)] = field[1:-1]
+        # Report groups with any mapped cells, the rest aren't worth reading
+        self._rcgroups = frozenset(group for group, _, _ in self._rcmap)
 
+        field_names = set(self.field_names())
         bad_redcap_fields = [field for field in self._rcmap.values()
-                             if field not in self.field_names()]
+                             if field not in field_names]
         if bad_redcap_fields:
             raise ValueError(
                     'These field(s) do not exist in the REDCap database:\n' +
                     ", ".join(bad_redcap_fields))
 
+        # Form completed field of each template field
+        self._completed_fields = {field: self.completed_field(field)
+                                  for field in self._rcmap.values()}
+
     def pull(self):
         errors = []
         pulled_data = []
-        for (subj_id, event), report in self._reports.items():
-            print(f'Parsing {subj_id}, {event}...')
+        rcmap, rcgroups = self._rcmap, self._rcgroups
+        completed_fields = self._completed_fields
+        skip_complete = self._skip_complete
+        uploaded_status = self._uploaded_status
+        id_field, event_field = self.id_field(), self.event_field()
+
+        # read the reports, in parallel if there are enough of them; they are
+        # independent of each other
+        report_paths = [report.report_path for report in self._reports.values()]
+        print(f'Parsing {len(report_paths)} reports...')
+        if len(report_paths) < _MIN_POOL_REPORTS:
+            report_cells = [_read_report_cells(path, rcgroups)
+                            for path in report_paths]
+        else:
+            max_workers = min(os.cpu_count() or 1, len(report_paths))
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                report_cells = list(executor.map(
+                        _read_report_cells, report_paths, repeat(rcgroups)))
+
+        for ((subj_id, event), report), cells in zip(self._reports.items(),
+                                                     report_cells):
+            print(f'Mapping scores for {subj_id}, {event}...')
             redcap_vals = {}
 
             try:
-                for group, test, col, val in qint_reader(report.report_path):
-                    try:
-                        redcap_field = self._rcmap[(group, test, col)]
-                    except KeyError:
+                if skip_complete:
+                    completed_forms = self.completed_forms(subj_id, event)
+
+                if isinstance(cells, RedcapUploaderError):
+                    raise cells
+                for group, test, col, val in cells:
+                    redcap_field = rcmap.get((group, test, col))
+                    if redcap_field is None:
                         continue
-                    if ( self._skip_complete and
-                         self.is_complete(subj_id, event, redcap_field) ):
+                    if ( skip_complete and
+                         self.field_form(redcap_field) in completed_forms ):
                         continue
                     else:
                         redcap_vals[redcap_field] = val
-                        completed_field = self.completed_field(redcap_field)
-                        redcap_vals[completed_field] = self._uploaded_status
+                        completed_field = completed_fields[redcap_field]
+                        redcap_vals[completed_field] = uploaded_status
 
                 if (report.info_path is not None) and self._info_rcmap:
                     info_vals = report.extract_info(self._info_rcmap)
                     for redcap_field, val in info_vals.items():
-                        if ( self._skip_complete and
-                             self.is_complete(subj_id, event, redcap_field) ):
+                        if ( skip_complete and
+                             self.field_form(redcap_field) in completed_forms ):
                             continue
                         else:
                             redcap_vals[redcap_field] = val
                             completed_field = self.completed_field(redcap_field)
-                            redcap_vals[completed_field] = self._uploaded_status
+                            redcap_vals[completed_field] = uploaded_status
 
             except RedcapUploaderError as err:
                 errors.append(err)
 
             if redcap_vals:
-                redcap_vals[self.id_field()] = subj_id
-                redcap_vals[self.event_field()] = event
+                redcap_vals[id_field] = subj_id
+                redcap_vals[event_field] = event
                 pulled_data.append(redcap_vals)
 
         return pulled_data, errors
@@ -98,66 +143,117 @@ class QInteractiveUploader(RedcapUploader):
         self._log_path = new_log_path
                 
 
-def qint_reader(qint_path):
-    qint_file = _read_unknown_encoding(qint_path)
-    qint_lines = [l.strip('"') for l in qint_file.readlines()]
-    qint_file.close()
+def qint_reader(qint_path, groups=None):
+    qint_text = _read_unknown_encoding(qint_path).read()
+
+    # Each group is a group name row, a blank row, a header row, then score
+    # rows up to the next blank row; every cell under a named column is
+    # collected as (group, test, column, value), only for the given groups
+    cells = []
+    state = _SEEK_GROUP
+    for line_num, row in _qint_rows(qint_text):
+        # Score rows are by far the most common, so they are checked first
+        if state == _IN_SCORES and row:
+            test = row[0]
+            cells += [(group, test, col_name, row[idx])
+                      for idx, col_name in score_cols]
+
+        elif state == _SEEK_GROUP:
+            if row and row[0]:
+                group = row[0]
+                state = _EXPECT_BLANK
+
+        elif state == _EXPECT_BLANK:
+            if row:
+                raise _parse_error(qint_path, line_num, group,
+                                   'expecting this line to be blank.')
+            state = _EXPECT_HEADER
+
+        elif state == _EXPECT_HEADER:
+            if not row:
+                raise _parse_error(qint_path, line_num, group,
+                                   'no header row after blank line.')
+            if groups is not None and group not in groups:
+                state = _SKIP_SCORES
+                continue
+            # Named score columns (index, name), skipping the test column
+            score_cols = [(idx, col_name) for idx, col_name
+                          in enumerate(row[1:], 1) if col_name]
+            state = _IN_SCORES
+
+        elif not row:
+            state = _SEEK_GROUP
+
+    if state in (_EXPECT_BLANK, _EXPECT_HEADER):
+        raise _parse_error(qint_path, line_num, group,
+                           'file ends before the header row.')
+
+    return cells
+
+
+def _read_report_cells(report_path, groups):
+    # May run in a worker process; parse errors are returned rather than raised
+    # so that one bad report doesn't lose the others
     try:
-        reader = csv.reader(qint_lines)
-        while 1:
-            # Group
-            try:
-                row = next(reader)
-                while not row or not row[0]:
-                    row = next(reader)
-            except StopIteration:
-                break
-
-            group = row[0]
-            if not group:
-                raise QInteractiveUploaderError(
-                        f'Parse error at line {",".join(row)}: '
-                         'expecting first column here to be a group.',
-                         form_path=qint_path)
-            if next(reader):
-                raise RedcapUploaderError(
-                        f'Parse error at {group}: expecting next line to be '
-                        f'blank.', form_path=qint_path)
-
-            # Header row
-            header_row = next(reader)
-            if not header_row:
-                raise RedcapUploaderError(
-                        f'Parse error at {group}: no header row after '
-                         'blank line.', form_path=qint_path)
-
-            # Scores
-            try:
-                row = next(reader)
-                while row:
-                    for idx, col_name in enumerate(header_row[1:]):
-                        if col_name:
-                            yield (group, row[0], col_name, row[idx+1])
-                    row = next(reader)
-            except StopIteration:
-                break
-    finally:
-        qint_file.close()
+        return qint_reader(report_path, groups)
+    except RedcapUploaderError as err:
+        return err
+
+
+def _qint_rows(qint_text):
+    # (line number of its first line, row) for each row of the file, with
+    # each line stripped of its surrounding quotes. A quote only starts a
+    # quoted field right after a comma here, so lines without ',"' give the
+    # same fields as the csv module by splitting on commas; csv.reader takes
+    # the others, with any following lines that a quoted field runs onto.
+    # Only '\n' ends a line, as when reading the file in text mode
+    lines = enumerate((l.strip('"') for l in io.StringIO(qint_text)), 1)
+    for line_num, line in lines:
+        if ',"' in line:
+            more_lines = (l for _, l in lines)
+            yield line_num, next(csv.reader(chain([line], more_lines)))
+        else:
+            if line.endswith('\n'):
+                line = line[:-1]
+            yield line_num, line.split(',') if line else []
+
+
+def _parse_error(qint_path, line_num, group, msg):
+    # Only built once parsing has failed, the success path formats nothing
+    return QInteractiveUploaderError(
+            f'Parse error at line {line_num} ({group}): {msg}',
+            form_path=qint_path)
 
 
 def _read_unknown_encoding(path, encodings=('utf16', 'utf8', 'Windows-1252')):
+    # The decoded text is cached by the file's identity, size and modification
+    # time (the size catches rewrites within a coarse mtime tick), so that a
+    # template shared by several uploaders is only read once while it's
+    # unchanged; newline translation matches opening the file in text mode.
+    # The file itself is closed before this returns, the in-memory StringIO
+    # needs no closing.
+    stat = os.stat(path)
+    text = _decode_unknown_encoding(path, stat.st_ino, stat.st_size,
+                                    stat.st_mtime_ns, encodings)
+    return io.StringIO(text, newline=None)
+
+
+@lru_cache(maxsize=32)
+def _decode_unknown_encoding(path, ino, size, mtime_ns, encodings):
+    # Read the file once and try each encoding on the bytes in memory. The
+    # incremental decoder is what text mode files use (unlike bytes.decode,
+    # its utf16 requires a BOM).
+    raw = Path(path).read_bytes()
+    if not raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        # Without a BOM the utf16 decode is bound to fail, skip it
+        encodings = [encoding for encoding in encodings
+                     if codecs.lookup(encoding).name != 'utf-16']
     for encoding in encodings:
-        f = open(path, 'r', encoding=encoding)
+        decoder = codecs.getincrementaldecoder(encoding)()
         try:
-            f.readlines()
-            f.seek(0)
-            return f
-        except (UnicodeError, UnicodeDecodeError):
-            f.close()
+            return decoder.decode(raw, final=True)
+        except UnicodeError:
             continue
-        except:
-            f.close()
-            raise
 
     raise QInteractiveUploaderError(
             'Could not read info file with provided encodings.', form_path=path)
@@ -172,21 +268,13 @@ class QInteractiveReport():
         if self.info_path is None:
             raise QInteractiveUploaderError(
                     'Cannot request info without an info path.',
-                    form_id='qinteractive', form_path=report_path)
-        vals_dict = {}
-        info_file = _read_unknown_encoding(self.info_path)
-        try:
-            lines = info_file.readlines()
-        finally:
-            info_file.close()
-
-        for line in lines:
-            split_vals = line.rstrip().split(': ', 1)
-            if len(split_vals) == 2 and split_vals[0] in mappings:
-                redcap_field = mappings[split_vals[0]][0]
-                xlate_fn = mappings[split_vals[0]][1]
-                vals_dict[redcap_field] = xlate_fn(split_vals[1])
-        return vals_dict
+                    form_id='qinteractive', form_path=self.report_path)
+        # (name, ': ', value) for every "name: value" line
+        info_lines = [line.rstrip().partition(': ')
+                      for line in _read_unknown_encoding(self.info_path)]
+
+        return {mappings[name][0]: mappings[name][1](val)
+                for name, sep, val in info_lines if sep and name in mappings}
 
 
 class QInteractiveUploaderError(RedcapUploaderError):
@@ -4,6 +4,12 @@ import json
 from dateutil.parser import parse as dateparse
 import requests
 
+# orjson decodes the (often large) record exports faster, but is optional
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 class RedcapUploader(ABC):
     """Abstract class defining uploaders that parse & upload scores to REDCap.
 
@@ -36,6 +42,7 @@ class RedcapUploader(ABC):
       _field_names: List of all fields in the project.
       _form_complete: Completed status for all forms across all subjects, s.t.
           self._form_complete[id][event][form] = completed status for that form
+      _batch_size: Maximum number of records sent in a single import request.
     """
 
     # REDCap default values for the `complete` fields
@@ -63,6 +70,8 @@ class RedcapUploader(ABC):
         the api_url and token, maps all REDCap fields to forms, notes the
         completed status for all records, and notes the project's events.
         """
+        self._batch_size = 500
+
         # Get field/form metadata
         fields = self._redcap_request('metadata')
         self._field_forms = {f['field_name']: f['form_name'] for f in fields}
@@ -121,7 +130,7 @@ class RedcapUploader(ABC):
         request_params.update(params)
         response = requests.post(self.api_url(), data=request_params)
         if response.reason == 'OK':
-            return json.loads(response.content)
+            return json_loads(response.content)
         elif response.reason == 'Forbidden':
             raise RedcapUploaderError(
                     'API request rejected (Forbidden). This is most likely due '
@@ -184,7 +193,7 @@ class RedcapUploader(ABC):
         Raises: RedcapUploaderError if the record_id is not in the REDCap
           database.
         """
-        if record_id not in self.record_ids():
+        if record_id not in self._form_complete:
             raise RedcapUploaderError(f'Record ID {record_id} not found in '
                                        'REDCap database.')
         form = self.field_form(field)
@@ -192,6 +201,29 @@ class RedcapUploader(ABC):
                 form in self._form_complete[record_id][event].keys() and
                 self._form_complete[record_id][event][form] == self.COMPLETE)
 
+    def completed_forms(self, record_id, event):
+        """Returns the forms with a 'complete' status for a given ID/event.
+
+        Lets uploaders check many fields of the same ID/event with a set lookup
+        on their form instead of an is_complete call per field.
+
+        Arguments:
+          record_id: The record identifier for the requested statuses.
+          event: The longitudinal event for the requested statuses.
+
+        Returns: Set of the names of the forms whose completion status is
+          complete for the record_id / event combination.
+
+        Raises: RedcapUploaderError if the record_id is not in the REDCap
+          database.
+        """
+        if record_id not in self._form_complete:
+            raise RedcapUploaderError(f'Record ID {record_id} not found in '
+                                       'REDCap database.')
+        return {form for form, status
+                in self._form_complete[record_id].get(event, {}).items()
+                if status == self.COMPLETE}
+
     @abstractmethod
     def pull(self):
         """Pulls & parses the uploader's scores and map to their REDCap fields.
@@ -234,31 +266,38 @@ class RedcapUploader(ABC):
         Arguments:
           data: Dictionary mapping REDCap fields to score values.
 
-        Returns: A matching `pull` dict list but with reformatted dates.
+        Returns: The same `pull` dict list, its dates reformatted in place.
         """
-        reformatted_data = data.copy()
-
         reformat_date = lambda x: dateparse(x).strftime('%Y-%m-%d')
+        date_fields = self.date_fields()
 
-        for record in reformatted_data:
-            for date_field in self.date_fields():
+        for record in data:
+            for date_field in date_fields:
                 try:
                     record[date_field] = reformat_date(record[date_field])
                 except KeyError:
                     pass
 
-        return reformatted_data
+        return data
 
     def push(self):
         """Pushes a dictionary of score values up to this REDCap database.
 
         This method uses the `pull` method to generate a list of dictionaries of
         field-names -> score values, scans it for errors, reformats the dates to
-        match REDCap specs, pushes the data to REDCap, writes the data to the
-        log file, and returns the subject-events that it pushed to REDCap.
+        match REDCap specs, pushes the data to REDCap in batches of at most
+        _batch_size records, writes the pushed data to the log file, and returns
+        the subject-events that it pushed to REDCap.
+
+        Batches are imported in order and a failed batch stops the push. The
+        batches before it are already in REDCap, so only those are logged and
+        returned; the failure is added to the errors with the number of
+        records that were not pushed. Any other exception is raised once the
+        committed batches are logged. Nothing is logged if nothing was pushed.
 
         Returns: List of (subject_id, event_string) tuples included in the
-          REDCap push request.
+          successful REDCap push requests, the record IDs REDCap returned for
+          them, and the errors.
 
         Raises: RedcapUploaderError if there is an error in the `pull` data.
         """
@@ -271,20 +310,36 @@ class RedcapUploader(ABC):
 
         clean_data = self._reformat_dates(clean_data)
 
-        log_path = self.log_path()
-        data_str = json.dumps(clean_data)
-        if log_path:
-            log_path.write_text(data_str)
-
-        params = {'returnContent': 'ids',
-                  'overwriteBehavior': 'overwrite',
-                  'data': data_str}
+        # Each import request returns the list of record IDs it touched
+        pushed_data = []
+        response = []
+        try:
+            for start in range(0, len(clean_data), self._batch_size):
+                batch = clean_data[start:start + self._batch_size]
+                params = {'returnContent': 'ids',
+                          'overwriteBehavior': 'overwrite',
+                          'data': json.dumps(batch)}
+                try:
+                    response += self._redcap_request('record', params)
+                except (RedcapUploaderError, requests.RequestException) as err:
+                    errors.append(RedcapUploaderError(
+                            f'Push stopped after {len(pushed_data)} of '
+                            f'{len(clean_data)} records, the remaining '
+                            f'{len(clean_data) - len(pushed_data)} were not '
+                            f'pushed: {getattr(err, "err_msg", err)}'))
+                    break
+                pushed_data += batch
+        finally:
+            # Log the committed batches even if the push was cut short by an
+            # unexpected error, but don't replace the last log with nothing
+            log_path = self.log_path()
+            if log_path and pushed_data:
+                log_path.write_text(json.dumps(pushed_data))
 
         subjs_tps = [(d[self.id_field()], d[self.event_field()])
-                     for d in clean_data]
+                     for d in pushed_data]
         subjs_tps.sort(key=lambda x: (x[1], x[0]))
-        
-        response = self._redcap_request('record', params)
+
         return subjs_tps, response, errors
 
     def _check_push_data(self, data):
@@ -0,0 +1,26 @@
+import copy
+import pickle
+
+import pytest
+
+from pushcap import (RedcapUploaderError, NIHTbUploaderError,
+                     QInteractiveUploaderError, QGlobalUploaderError,
+                     DkefsUploaderError, CptUploaderError, KsadsUploaderError)
+
+ERROR_CLASSES = (RedcapUploaderError, NIHTbUploaderError,
+                 QInteractiveUploaderError, QGlobalUploaderError,
+                 DkefsUploaderError, CptUploaderError, KsadsUploaderError)
+
+
+@pytest.mark.parametrize('error_cls', ERROR_CLASSES)
+@pytest.mark.parametrize('round_trip', (lambda e: pickle.loads(pickle.dumps(e)),
+                                        copy.copy))
+def test_error_round_trip(error_cls, round_trip):
+    # Errors cross process boundaries when reports are parsed in workers
+    err = error_cls('Bad report.', subj_id='12345', event='year_1_arm_1',
+                    form_path='report.csv')
+    restored = round_trip(err)
+
+    assert type(restored) is error_cls
+    assert vars(restored) == vars(err)
+    assert str(restored) == str(err)
@@ -28,13 +28,15 @@ class NIHToolboxUploader(RedcapUploader):
         self._token = token
         super().__init__()
 
+        # group csv paths by (subj_id, event), keeping first-seen order
         self._csv_tuples = []
+        csv_tuple_idx = {}
         for subj_id, event, csv_path in csv_tuples:
-            for prev_subj_id, prev_event, csv_paths in self._csv_tuples:
-                if subj_id == prev_subj_id and event == prev_event:
-                    csv_paths.append(csv_path)
-                    break
+            key = (subj_id, event)
+            if key in csv_tuple_idx:
+                self._csv_tuples[csv_tuple_idx[key]][2].append(csv_path)
             else:
+                csv_tuple_idx[key] = len(self._csv_tuples)
                 self._csv_tuples.append((subj_id, event, [csv_path]))
             
         self._log_path = log_path